@@ -13,7 +13,7 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
-from sqlalchemy import select, func, delete
+from sqlalchemy import bindparam, select, func, delete
 
 from ..models import base as db
 from ..models.user import User
@@ -24,10 +24,15 @@ from .main_menu import (
     notify_basic_access_limited,
     notify_vip_access_limited,
     notify_vip_granted,
+    _USER_BY_TG_STMT,
 )
 
 router = Router()
 
+# Настройки всегда одной строкой с id = 1
+_SETTINGS_STMT = select(Settings).where(Settings.id == 1)
+_USER_BY_TRADER_STMT = select(User).where(User.trader_id == bindparam("trader_id"))
+
 
 # ===== ADMIN ACCESS =====
 
@@ -83,18 +88,13 @@ class AdminUsersSearchState(StatesGroup):
 
 # ===== HELPERS: DB & STATS =====
 
-async def _get_or_create_settings() -> Settings:
+async def _get_settings() -> Settings:
     if db.async_session_maker is None:
         raise RuntimeError("DB session maker is not initialized")
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
-            await session.commit()
-            await session.refresh(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         return settings
 
 
@@ -147,7 +147,7 @@ async def _send_admin_menu(bot, chat_id: int) -> None:
 
 
 async def _send_links_window(bot, chat_id: int) -> None:
-    settings = await _get_or_create_settings()
+    settings = await _get_settings()
 
     def norm(val: Optional[str]) -> str:
         return val if val else "— не задано —"
@@ -237,8 +237,8 @@ async def _send_user_card(bot, chat_id: int, user_id: int, page: int = 1) -> Non
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(User).where(User.id == user_id))
-        user: Optional[User] = result.scalar_one_or_none()
+        # по первичному ключу — через identity map сессии
+        user: Optional[User] = await session.get(User, user_id)
         if user is None:
             await bot.send_message(chat_id, "Пользователь не найден.")
             return
@@ -289,7 +289,7 @@ async def _send_user_card(bot, chat_id: int, user_id: int, page: int = 1) -> Non
 
 
 async def _send_settings_window(bot, chat_id: int) -> None:
-    settings = await _get_or_create_settings()
+    settings = await _get_settings()
 
     def yn(val: bool) -> str:
         return "✅ Да" if val else "❌ Нет"
@@ -321,7 +321,7 @@ async def _send_settings_window(bot, chat_id: int) -> None:
 
 
 async def _send_steps_window(bot, chat_id: int) -> None:
-    settings = await _get_or_create_settings()
+    settings = await _get_settings()
 
     def yn(val: bool) -> str:
         return "✅ Да" if val else "❌ Нет"
@@ -358,7 +358,7 @@ async def _send_steps_window(bot, chat_id: int) -> None:
 
 
 async def _send_postbacks_group_window(bot, chat_id: int) -> None:
-    settings = await _get_or_create_settings()
+    settings = await _get_settings()
 
     def yn(val: bool) -> str:
         return "✅ Вкл" if val else "❌ Выкл"
@@ -697,11 +697,8 @@ async def admin_links_set_ref(message: Message, state: FSMContext) -> None:
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.ref_link = new_value
         await session.commit()
 
@@ -726,11 +723,8 @@ async def admin_links_set_deposit(message: Message, state: FSMContext) -> None:
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.deposit_link = new_value
         await session.commit()
 
@@ -755,11 +749,8 @@ async def admin_links_set_channel_id(message: Message, state: FSMContext) -> Non
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.channel_id = new_value
         await session.commit()
 
@@ -784,11 +775,8 @@ async def admin_links_set_channel_url(message: Message, state: FSMContext) -> No
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.channel_url = new_value
         await session.commit()
 
@@ -813,11 +801,8 @@ async def admin_links_set_support(message: Message, state: FSMContext) -> None:
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.support_url = new_value
         await session.commit()
 
@@ -880,11 +865,8 @@ async def admin_steps_toggle(callback: CallbackQuery) -> None:
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
 
         if field == "subscription":
             settings.require_subscription = not bool(settings.require_subscription)
@@ -958,11 +940,8 @@ async def admin_steps_set_deposit_amount(message: Message, state: FSMContext) ->
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.deposit_required_amount = value
         await session.commit()
 
@@ -994,11 +973,8 @@ async def admin_steps_set_vip_amount(message: Message, state: FSMContext) -> Non
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.vip_threshold_amount = value
         await session.commit()
 
@@ -1044,11 +1020,8 @@ async def admin_postbacks_group_toggle(callback: CallbackQuery) -> None:
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
 
         if field == "registration":
             settings.send_postbacks_registration = not bool(
@@ -1117,11 +1090,8 @@ async def admin_postbacks_group_set_chat(message: Message, state: FSMContext) ->
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
         settings.postbacks_chat_id = new_value
         await session.commit()
 
@@ -1413,15 +1383,12 @@ async def admin_users_search_query(message: Message, state: FSMContext) -> None:
         # если число — пробуем как telegram_id
         if query.isdigit():
             tg_id = int(query)
-            result = await session.execute(
-                select(User).where(User.telegram_id == tg_id)
-            )
-            user = result.scalar_one_or_none()
+            user = await session.scalar(_USER_BY_TG_STMT, {"tg_id": tg_id})
 
         # если не нашли по tg_id или query не число — пробуем как trader_id
         if user is None:
             result = await session.execute(
-                select(User).where(User.trader_id == query)
+                _USER_BY_TRADER_STMT, {"trader_id": query}
             )
             user = result.scalar_one_or_none()
 
@@ -1490,13 +1457,13 @@ async def admin_user_actions(callback: CallbackQuery) -> None:
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(User).where(User.id == user_id))
-        user: Optional[User] = result.scalar_one_or_none()
+        # по первичному ключу — через identity map сессии
+        user: Optional[User] = await session.get(User, user_id)
         if user is None:
             await callback.answer("Пользователь не найден", show_alert=True)
             return
 
-        settings = await _get_or_create_settings()
+        settings = await _get_settings()
 
         # --- ВЫДАТЬ РЕГУ ---
         if action == "give_reg":
@@ -1522,6 +1489,7 @@ async def admin_user_actions(callback: CallbackQuery) -> None:
 
             dep = Deposit(user_id=user.id, amount=amount)
             session.add(dep)
+            user.total_deposits = User.total_deposits + amount
             await session.commit()
 
             await callback.answer("Депозит выдан", show_alert=False)
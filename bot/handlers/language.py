@@ -5,11 +5,10 @@ from typing import Optional
 from aiogram import Router, F
 from aiogram.filters import CommandStart
 from aiogram.types import Message, CallbackQuery
-from sqlalchemy import select
 
 from ..models import base as db
 from ..models.user import User
-from .main_menu import send_main_menu, send_language_choice
+from .main_menu import send_main_menu, send_language_choice, _USER_BY_TG_STMT
 
 router = Router()
 
@@ -23,10 +22,7 @@ async def _get_or_create_user(tg_id: int, username: Optional[str]) -> User:
         raise RuntimeError("DB session maker is not initialized")
 
     async with db.async_session_maker() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == tg_id)
-        )
-        user: Optional[User] = result.scalar_one_or_none()
+        user: Optional[User] = await session.scalar(_USER_BY_TG_STMT, {"tg_id": tg_id})
 
         if user is None:
             user = User(
@@ -106,10 +102,9 @@ async def handle_set_language(callback: CallbackQuery) -> None:
         return
 
     async with db.async_session_maker() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == from_user.id)
+        user: Optional[User] = await session.scalar(
+            _USER_BY_TG_STMT, {"tg_id": from_user.id}
         )
-        user: Optional[User] = result.scalar_one_or_none()
 
         if user is None:
             # на всякий случай, если по какой-то причине нет записи
@@ -13,7 +13,7 @@ from aiogram.types import (
     WebAppInfo,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import select, func
+from sqlalchemy import bindparam, select, func
 
 from ..models import base as db
 from ..models.user import User
@@ -22,6 +22,12 @@ from ..models.deposit import Deposit
 
 router = Router()
 
+# Настройки всегда одной строкой с id = 1
+_SETTINGS_STMT = select(Settings).where(Settings.id == 1)
+
+# Запросы собираются один раз — SQLAlchemy берёт их из кэша компиляции
+_USER_BY_TG_STMT = select(User).where(User.telegram_id == bindparam("tg_id"))
+
 BASE_DIR = Path(__file__).resolve().parents[2]
 
 # URL мини-апп берём из .env
@@ -382,8 +388,7 @@ async def _get_or_create_user(tg_id: int, username: Optional[str] = None) -> Use
         raise RuntimeError("DB not initialized")
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(User).where(User.telegram_id == tg_id))
-        user: Optional[User] = result.scalar_one_or_none()
+        user: Optional[User] = await session.scalar(_USER_BY_TG_STMT, {"tg_id": tg_id})
         if user is None:
             user = User(
                 telegram_id=tg_id,
@@ -408,8 +413,7 @@ async def _get_user_lang(tg_id: int) -> str:
     if db.async_session_maker is None:
         return "en"
     async with db.async_session_maker() as session:
-        res = await session.execute(select(User).where(User.telegram_id == tg_id))
-        user: Optional[User] = res.scalar_one_or_none()
+        user: Optional[User] = await session.scalar(_USER_BY_TG_STMT, {"tg_id": tg_id})
         if user and user.language:
             return user.language
     return "en"
@@ -419,13 +423,8 @@ async def _get_settings() -> Settings:
     if db.async_session_maker is None:
         raise RuntimeError("DB not initialized")
     async with db.async_session_maker() as session:
-        res = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = res.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
-            await session.commit()
-            await session.refresh(settings)
+        res = await session.execute(_SETTINGS_STMT)
+        settings: Settings = res.scalar_one()
         return settings
 
 
@@ -948,10 +947,7 @@ async def handle_channel_subscription(event: ChatMemberUpdated, bot: Bot) -> Non
 
     if db.async_session_maker is not None:
         async with db.async_session_maker() as session:
-            result = await session.execute(
-                select(User).where(User.telegram_id == tg_id)
-            )
-            user: Optional[User] = result.scalar_one_or_none()
+            user: Optional[User] = await session.scalar(_USER_BY_TG_STMT, {"tg_id": tg_id})
             if user:
                 user.is_subscribed = True
                 await session.commit()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timezone
+from typing import Union
+
+import orjson
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra=
+_RECORD_ATTRS = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None))
+) | {"message", "asctime"}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Одна запись лога = одна JSON-строка:
+    {"ts": ..., "level": ..., "logger": ..., "msg": ..., <поля из extra>}
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        # default=str: Decimal, datetime и прочее, чего orjson не знает
+        return orjson.dumps(payload, default=str).decode()
+
+
+def configure(level: Union[int, str] = logging.INFO) -> None:
+    """
+    Единая настройка логирования для бота и постбэк-приложения.
+    Повторный вызов ничего не меняет (как и logging.basicConfig).
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    # из окружения уровень приходит как есть: "info" тоже должен работать
+    if isinstance(level, str):
+        level = level.strip().upper()
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLinesFormatter())
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -1,11 +1,18 @@
 import asyncio
 import logging
+import os
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
+try:
+    import uvloop
+except ImportError:  # uvloop не ставится на Windows — остаёмся на asyncio
+    uvloop = None
+
 from .config import load_config
+from .logging_setup import configure as configure_logging
 from .models.base import setup_db, init_db
 from .handlers.language import router as language_router
 from .handlers.main_menu import router as main_menu_router
@@ -13,10 +20,7 @@ from .handlers.admin import router as admin_router
 
 
 async def main() -> None:
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-    )
+    configure_logging(os.getenv("LOG_LEVEL", "INFO"))
 
     config = load_config()
 
@@ -42,4 +46,6 @@ async def main() -> None:
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     asyncio.run(main())
\ No newline at end of file
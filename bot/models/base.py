@@ -1,7 +1,12 @@
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+import sqlite3
+from typing import Any, Callable, Dict, Optional
 
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -9,23 +14,102 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.schema import CreateIndex
 
 # Базовый класс для всех моделей
 Base = declarative_base()
 
+# insert() с ON CONFLICT для поддерживаемых диалектов
+_DIALECT_INSERTS: Dict[str, Callable] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
 # Глобальные объекты для engine и фабрики сессий
 engine: Optional[AsyncEngine] = None
 async_session_maker: Optional[async_sessionmaker[AsyncSession]] = None
 
 
-def setup_db(database_url: str) -> None:
+# Запросы хэндлеров вынесены в константы модулей; кэш компиляции
+# с запасом, чтобы они не вытеснялись
+QUERY_CACHE_SIZE = 1200
+
+# сколько секунд ждать свободное соединение из пула (Postgres)
+POOL_TIMEOUT = 10
+
+# UPSERT ... RETURNING в постбэках: SQLite умеет RETURNING с 3.35
+SQLITE_MIN_VERSION = (3, 35, 0)
+
+# Ключ pg_advisory_xact_lock для миграций в init_db: бот и все воркеры
+# постбэк-приложения стартуют одновременно и мигрируют одну и ту же БД
+_MIGRATION_LOCK_KEY = 0x6A6F676F746F
+
+# Индексы, которые заменены более широкими и в моделях больше не описаны:
+# create_all их не трогает, в старых БД удаляем явно
+_REPLACED_INDEXES = (
+    "ix_users_telegram_id",  # -> ix_users_telegram_id_covering
+    "ix_deposits_user_id",  # -> ix_deposits_user_amount
+)
+
+
+def setup_db(
+    database_url: str,
+    pool_size: int = 25,
+    max_overflow: int = 25,
+    async_commit: bool = False,
+) -> None:
     """
     Инициализация async engine и фабрики сессий.
     Вызывается один раз при старте приложения (в main.py).
+
+    Для сетевых БД (Postgres) пул задаём явно: соединения переиспользуются
+    между постбэками, протухшие отсекаются pre_ping/recycle. Если пул
+    забит, запрос ждёт соединение не дольше POOL_TIMEOUT секунд и падает,
+    а не висит до таймаута партнёрки.
+    SQLite оставляем с пулом по умолчанию — запись там всё равно одна.
+
+    async_commit=True (Postgres + asyncpg): synchronous_commit=off —
+    commit не ждёт fsync WAL, сервер сбрасывает WAL пачками. При падении
+    сервера БД теряются последние доли секунды коммитов, но данные остаются
+    согласованными. Для SQLite то же даёт synchronous=NORMAL (см. ниже).
     """
     global engine, async_session_maker
 
-    engine = create_async_engine(database_url, echo=False, future=True)
+    url = make_url(database_url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    # иначе каждый депозит падал бы уже при компиляции запроса
+    if is_sqlite and sqlite3.sqlite_version_info < SQLITE_MIN_VERSION:
+        raise RuntimeError(
+            f"SQLite {sqlite3.sqlite_version} is too old: "
+            f"UPSERT ... RETURNING needs SQLite >= "
+            f"{'.'.join(map(str, SQLITE_MIN_VERSION))}"
+        )
+
+    engine_kwargs: Dict[str, Any] = {}
+    if not is_sqlite:
+        engine_kwargs.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            pool_timeout=POOL_TIMEOUT,
+        )
+    if async_commit and url.get_driver_name() == "asyncpg":
+        engine_kwargs["connect_args"] = {
+            "server_settings": {"synchronous_commit": "off"},
+        }
+
+    engine = create_async_engine(
+        database_url,
+        echo=False,
+        future=True,
+        query_cache_size=QUERY_CACHE_SIZE,
+        **engine_kwargs,
+    )
+    if is_sqlite:
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
     async_session_maker = async_sessionmaker(
         engine,
         expire_on_commit=False,
@@ -33,6 +117,17 @@ def setup_db(database_url: str) -> None:
     )
 
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    WAL: бот и постбэк-приложение читают файл, не блокируясь об запись друг друга.
+    synchronous=NORMAL: в режиме WAL безопасно и без fsync на каждый commit.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 async def init_db() -> None:
     """
     Создание таблиц в БД (если их ещё нет).
@@ -46,4 +141,99 @@ async def init_db() -> None:
     from . import user, deposit, settings  # noqa: F401
 
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        # Миграции ниже — check-then-act. DDL и в Postgres, и в SQLite
+        # транзакционный, поэтому одновременно стартующие процессы
+        # выполняют их по очереди под блокировкой до commit
+        if conn.dialect.name == "postgresql":
+            await conn.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"),
+                {"key": _MIGRATION_LOCK_KEY},
+            )
+        elif conn.dialect.name == "sqlite":
+            # pysqlite сам BEGIN перед DDL не шлёт — берём блокировку
+            # на запись в файл сразу (ждёт busy timeout драйвера)
+            await conn.exec_driver_sql("BEGIN IMMEDIATE")
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.run_sync(_drop_replaced_indexes)
+        await conn.run_sync(_add_users_total_deposits)
+
+        # Строка настроек (id = 1) гарантированно есть после старта —
+        # дальше по коду настройки только читаются/обновляются.
+        settings_table = settings.Settings.__table__
+        await conn.execute(
+            dialect_insert(conn.dialect.name)(settings_table)
+            .values(id=1)
+            .on_conflict_do_nothing(index_elements=[settings_table.c.id])
+        )
+
+
+async def warm_up_pool() -> None:
+    """
+    Открываем соединения пула заранее (SELECT 1 на каждый слот),
+    чтобы первые запросы после старта не платили за коннект и авторизацию.
+    """
+    if engine is None:
+        raise RuntimeError("DB engine is not initialized. Call setup_db() first.")
+
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+
+    async def _ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # соединения держатся одновременно — иначе пул переиспользует одно
+    await asyncio.gather(*(_ping() for _ in range(size)))
+
+
+def _add_users_total_deposits(sync_conn) -> None:
+    """
+    Колонка users.total_deposits появилась позже самой таблицы:
+    в старой БД добавляем её и заполняем суммой уже записанных депозитов.
+    """
+    columns = {c["name"] for c in inspect(sync_conn).get_columns("users")}
+    if "total_deposits" in columns:
+        return
+
+    sync_conn.execute(text(
+        "ALTER TABLE users "
+        "ADD COLUMN total_deposits NUMERIC(12, 2) NOT NULL DEFAULT 0"
+    ))
+    sync_conn.execute(text(
+        "UPDATE users SET total_deposits = ("
+        "SELECT COALESCE(SUM(deposits.amount), 0) "
+        "FROM deposits WHERE deposits.user_id = users.id"
+        ")"
+    ))
+
+
+def dialect_insert(dialect_name: str) -> Callable:
+    """
+    insert() конкретного диалекта — с on_conflict_do_nothing/do_update и excluded.
+    """
+    try:
+        return _DIALECT_INSERTS[dialect_name]
+    except KeyError:
+        raise RuntimeError(f"Unsupported database dialect: {dialect_name}") from None
+
+
+def _create_missing_indexes(sync_conn) -> None:
+    """
+    create_all создаёт индексы только вместе с новыми таблицами.
+    Для уже существующих таблиц досоздаём индексы, добавленные в модели позже.
+    CREATE INDEX IF NOT EXISTS (SQLite и Postgres) — без гонки между
+    проверкой и созданием у одновременно стартующих процессов.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            sync_conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _drop_replaced_indexes(sync_conn) -> None:
+    """
+    Старые индексы дублируют новые (тот же ведущий столбец) и только
+    замедляют запись. Удаляем после создания замены, чтобы поиск
+    по telegram_id / user_id ни на момент не остался без индекса.
+    """
+    for name in _REPLACED_INDEXES:
+        sync_conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
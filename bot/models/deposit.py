@@ -1,13 +1,13 @@
 from __future__ import annotations
 
-from datetime import datetime
-
 from sqlalchemy import (
     Column,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     Numeric,
+    func,
 )
 
 from .base import Base
@@ -20,13 +20,22 @@ class Deposit(Base):
     """
 
     __tablename__ = "deposits"
+    __table_args__ = (
+        # SUM(amount) по юзеру (карточка в админке, шаг депозита)
+        # считается прямо по индексу, без чтения строк таблицы
+        Index("ix_deposits_user_amount", "user_id", "amount"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # отдельный индекс по user_id не нужен — он ведущая колонка ix_deposits_user_amount
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     amount = Column(Numeric(12, 2), nullable=False, default=0)
     created_at = Column(
         DateTime(timezone=True),
-        default=datetime.utcnow,
+        # время ставит сама БД (now() прямо в INSERT, без параметра из Python);
+        # default нужен для таблиц, созданных ещё без server_default
+        default=func.now(),
+        server_default=func.now(),
         nullable=False,
     )
 
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-from sqlalchemy import Column, Integer, String, Boolean, Numeric
+from sqlalchemy import Column, Integer, String, Boolean, Numeric, event, text
 
 from .base import Base
 
+# Канал Postgres NOTIFY: постбэк-приложение перечитывает настройки по сигналу
+SETTINGS_UPDATED_CHANNEL = "settings_updated"
+
 
 class Settings(Base):
     """
@@ -72,4 +75,14 @@ class Settings(Base):
             f"send_postbacks_registration={self.send_postbacks_registration} "
             f"send_postbacks_deposit={self.send_postbacks_deposit} "
             f"send_postbacks_withdraw={self.send_postbacks_withdraw}>"
-        )
\ No newline at end of file
+        )
+
+
+@event.listens_for(Settings, "after_update")
+def _notify_settings_updated(mapper, connection, target) -> None:
+    """
+    NOTIFY уходит вместе с commit транзакции, в которой админка
+    поменяла настройки. В SQLite такого механизма нет — там пропускаем.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(f"NOTIFY {SETTINGS_UPDATED_CHANNEL}"))
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from datetime import datetime
+from decimal import Decimal
 from typing import Optional
 
-from sqlalchemy import BigInteger, String, Boolean, DateTime, Integer
+from sqlalchemy import BigInteger, String, Boolean, DateTime, Integer, Index, Numeric, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .base import Base
@@ -26,17 +27,35 @@ class User(Base):
 
     Интеграция с брокером:
     - trader_id: ID пользователя на стороне брокера (из постбэка Pocket Option)
+    - total_deposits: сумма всех депозитов (обновляется вместе с вставкой Deposit)
     """
 
     __tablename__ = "users"
+    __table_args__ = (
+        # Уникальный индекс по telegram_id с INCLUDE-колонками (Postgres):
+        # постбэки читают юзера index-only scan'ом, без похода в heap.
+        # На SQLite INCLUDE игнорируется — остаётся обычный уникальный индекс.
+        Index(
+            "ix_users_telegram_id_covering",
+            "telegram_id",
+            unique=True,
+            postgresql_include=[
+                "id",
+                "trader_id",
+                "is_registered",
+                "is_vip",
+                "has_basic_access",
+                "is_subscribed",
+            ],
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
 
+    # уникальность — через ix_users_telegram_id_covering (см. __table_args__)
     telegram_id: Mapped[int] = mapped_column(
         BigInteger,
-        unique=True,
         nullable=False,
-        index=True,
     )
 
     username: Mapped[Optional[str]] = mapped_column(
@@ -85,19 +104,31 @@ class User(Base):
         index=True,
     )
 
+    # накопительная сумма депозитов — чтобы не считать SUM по deposits
+    total_deposits: Mapped[Decimal] = mapped_column(
+        Numeric(12, 2),
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
     # --- таймстемпы ---
+    # Значения считает БД (now() рендерится прямо в INSERT/UPDATE).
+    # default дублирует server_default для таблиц, созданных до его появления.
 
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         nullable=False,
-        default=datetime.utcnow,
+        default=func.now(),
+        server_default=func.now(),
     )
 
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         nullable=False,
-        default=datetime.utcnow,
-        onupdate=datetime.utcnow,
+        default=func.now(),
+        server_default=func.now(),
+        onupdate=func.now(),
     )
 
     def __repr__(self) -> str:
@@ -1,21 +1,42 @@
 from __future__ import annotations
 
+import asyncio
+import hmac
+import html
 import logging
 import os
-from typing import Optional, Dict, Any
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import partial
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Tuple
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import PlainTextResponse
+import orjson
+
+from fastapi import FastAPI, Request, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import PlainTextResponse, Response
 
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from aiogram.types import LinkPreviewOptions
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, literal, update
+from sqlalchemy.exc import SQLAlchemyError
 
+from bot.logging_setup import configure as configure_logging
 from bot.models import base as db
 from bot.models.user import User
 from bot.models.deposit import Deposit
-from bot.models.settings import Settings
+from bot.models.settings import Settings, SETTINGS_UPDATED_CHANNEL
 from bot.handlers.main_menu import (
     run_access_flow_for_user,
     notify_vip_granted,
@@ -25,11 +46,11 @@ from bot.handlers.main_menu import (
 # Логгер
 # -------------------------------------------------
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s] [%(levelname)s] %(name)s: %(message)s",
-)
+configure_logging(os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger("postbacks")
+# можно держать общий уровень WARNING, а постбэки логировать подробнее
+if os.getenv("POSTBACK_LOG_LEVEL"):
+    logger.setLevel(os.environ["POSTBACK_LOG_LEVEL"].strip().upper())
 
 # -------------------------------------------------
 # Конфиг и глобальные объекты
@@ -40,393 +61,932 @@ if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is not set")
 
 POSTBACK_SECRET = os.getenv("BROKER_POSTBACK_SECRET") or ""
+POSTBACK_SECRET_B = POSTBACK_SECRET.encode()
+
+
+class KeepAliveSession(AiohttpSession):
+    """
+    AiohttpSession с настроенным TCPConnector.
+
+    Одна сессия на процесс: keep-alive соединения к api.telegram.org
+    переживают пачку постбэков, без нового TLS-handshake на каждое сообщение.
+    AiohttpSession наружу отдаёт только limit, остальные параметры коннектора
+    лежат в приватном _connector_init (aiogram 3.x, версия ограничена
+    в requirements.txt) — трогаем его только здесь.
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 50,
+        keepalive_timeout: float = 60,
+    ) -> None:
+        super().__init__(limit=limit)
+        connector_init = getattr(self, "_connector_init", None)
+        if not isinstance(connector_init, dict):
+            raise RuntimeError(
+                "Unsupported aiogram version: AiohttpSession._connector_init is missing"
+            )
+        connector_init.update(
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+        )
+
+
+bot_session = KeepAliveSession()
+
+bot = Bot(
+    token=BOT_TOKEN,
+    session=bot_session,
+    default=DefaultBotProperties(parse_mode="HTML"),
+)
 
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
 
-app = FastAPI(title="Jogoto postbacks")
+# Запрос единственной строки настроек: собираем один раз, дальше
+# SQLAlchemy берёт скомпилированный SQL из кэша по готовому ключу
+_SETTINGS_STMT = select(Settings).where(Settings.id == 1)
+
+# Настройки меняются только из админки (процесс бота), а читаются на каждом
+# постбэке — держим снимок в памяти. На Postgres админка шлёт NOTIFY и снимок
+# перечитывается сразу; в любом случае (а на SQLite — только так) он
+# перечитывается раз в SETTINGS_REFRESH_INTERVAL.
+SETTINGS_REFRESH_INTERVAL = 10.0
+_settings_changed = asyncio.Event()
+_settings_refresh_task: Optional[asyncio.Task[None]] = None
+# соединение asyncpg с LISTEN (только Postgres); живёт вне пула engine
+_settings_listener_conn: Optional[Any] = None
+
+
+@dataclass(frozen=True)
+class PostbackSettings:
+    """
+    Снимок полей Settings, которые нужны постбэкам.
+    """
+
+    postbacks_chat_id: Optional[str]
+    send_postbacks_registration: bool
+    send_postbacks_deposit: bool
+    send_postbacks_withdraw: bool
+    vip_threshold_amount: Decimal
+
+
+# загружается в lifespan, дальше только подменяется целиком
+_settings_row: Optional[PostbackSettings] = None
+
+
+# -------------------------------------------------
+# Шаблоны сообщений в группу постбэков
+# -------------------------------------------------
+
+# %-шаблоны: (trader_id, tg_id[, сумма строкой])
+_TPL_REGISTRATION = (
+    "📝 <b>Регистрация</b>\n"
+    "trader_id: <code>%s</code>\n"
+    "tg_id: <code>%s</code>\n"
+)
+_TPL_DEPOSIT = (
+    "💰 <b>Депозит</b>\n"
+    "trader_id: <code>%s</code>\n"
+    "tg_id: <code>%s</code>\n"
+    "sumdep: <b>%s$</b>\n"
+)
+_TPL_WITHDRAW = (
+    "💸 <b>Вывод средств</b>\n"
+    "trader_id: <code>%s</code>\n"
+    "tg_id: <code>%s</code>\n"
+    "wdr_sum: <b>%s$</b>\n"
+)
+
+_TPL_POSTBACK: Dict[str, str] = {
+    "registration": _TPL_REGISTRATION,
+    "deposit": _TPL_DEPOSIT,
+    "withdraw": _TPL_WITHDRAW,
+}
+
+# превью ссылок в служебных сообщениях не нужно
+_NO_LINK_PREVIEW = LinkPreviewOptions(is_disabled=True)
+
+# Сообщения в группу уходят фоновым воркером: ответ партнёрке не ждёт
+# Telegram и не упирается в его 429.
+_notify_queue: asyncio.Queue[Dict[str, Any]] = asyncio.Queue(maxsize=10_000)
+# лимит Telegram — 4096 символов, держим запас
+NOTIFY_BATCH_LIMIT = 3500
+
+# сколько юзеров одновременно проходят access flow (запросы к Bot API)
+ACCESS_FLOW_CONCURRENCY = int(os.getenv("ACCESS_FLOW_CONCURRENCY", "16"))
+_access_flow_sem = asyncio.Semaphore(ACCESS_FLOW_CONCURRENCY)
+_notify_worker_task: Optional[asyncio.Task[None]] = None
 
 
 # -------------------------------------------------
 # Вспомогательные функции
 # -------------------------------------------------
 
+# Ответы-ошибки не меняются — создаём один раз. with_traceback(None) при raise:
+# иначе traceback одного и того же объекта рос бы с каждым запросом.
+_ERR_FORBIDDEN = HTTPException(status_code=403, detail="Forbidden")
+_ERR_DB_NOT_INITIALIZED = HTTPException(status_code=500, detail="DB not initialized")
+
+
 async def check_secret(request: Request) -> None:
     """
     Если BROKER_POSTBACK_SECRET задан, проверяем его либо в query ?secret=,
-    либо в заголовке X-Postback-Secret. Если пустой — ничего не проверяем.
+    либо в заголовке X-Postback-Secret (query в приоритете).
+    Если пустой — ничего не проверяем.
+    Сравнение одно, через hmac.compare_digest — за постоянное время.
+
+    Подключается к роутам через Depends (см. _SECRET_CHECK). Функция остаётся
+    async: синхронные зависимости FastAPI гоняет через threadpool.
     """
-    if not POSTBACK_SECRET:
+    if not POSTBACK_SECRET_B:
         return
 
-    q_secret = request.query_params.get("secret")
-    h_secret = request.headers.get("X-Postback-Secret")
+    provided = (
+        request.query_params.get("secret")
+        or request.headers.get("X-Postback-Secret")
+        or ""
+    ).encode()
 
-    if q_secret != POSTBACK_SECRET and h_secret != POSTBACK_SECRET:
+    if not hmac.compare_digest(provided, POSTBACK_SECRET_B):
         logger.warning("Postback rejected: invalid secret")
-        raise HTTPException(status_code=403, detail="Forbidden")
+        raise _ERR_FORBIDDEN.with_traceback(None)
+
+
+_SECRET_CHECK = [Depends(check_secret)]
+
+# Партнёрки ретраят постбэки: повтор registration / first_deposit
+# (событие, trader_id, tg_id[, сумма]) в пределах TTL в БД второй раз не пишем.
+# Память своя у каждого процесса (воркера gunicorn); 0 — выключено.
+POSTBACK_DEDUP_TTL = float(os.getenv("POSTBACK_DEDUP_TTL", "3600"))
+POSTBACK_DEDUP_MAXSIZE = 100_000
+# записанные в БД: ключ -> момент истечения
+_recent_postbacks: OrderedDict[Tuple[Any, ...], float] = OrderedDict()
+# пишутся прямо сейчас: ключ -> Future с итогом (True — commit прошёл)
+_inflight_postbacks: Dict[Tuple[Any, ...], asyncio.Future[bool]] = {}
+
+
+# click_id = Telegram id юзера: только цифры, и влезает в BIGINT
+_CLICK_ID_RE = re.compile(r"[0-9]{1,19}")
+_BIGINT_MAX = 2**63 - 1
+
+
+def _parse_click_id(raw: Any) -> Optional[int]:
+    """
+    click_id -> tg_id. Мусор вроде «{click_id}» (партнёрка не подставила
+    макрос) или число вне BIGINT отсекаем до запроса в БД.
+    """
+    raw = str(raw)
+    if not _CLICK_ID_RE.fullmatch(raw):
+        return None
+    tg_id = int(raw)
+    if tg_id > _BIGINT_MAX:
+        return None
+    return tg_id
+
+
+# суммы хранятся как Numeric(12, 2): ровно центы, до 10^10
+_CENT = Decimal("0.01")
+_AMOUNT_LIMIT = Decimal("1e10")
+
+
+def _parse_amount(raw: Any) -> Optional[Decimal]:
+    """
+    Сумма из постбэка ("12.5" или "12,5") -> Decimal в центах, без прохода
+    через float. Округляем здесь, а не в БД: в сообщении, в total_deposits
+    и в deposits окажется одно и то же число.
+    """
+    try:
+        amount = Decimal(str(raw).replace(",", "."))
+    except InvalidOperation:
+        return None
+    # до quantize: у огромных чисел он сам падает с InvalidOperation
+    if not amount.is_finite() or abs(amount) >= _AMOUNT_LIMIT:
+        return None
+    amount = amount.quantize(_CENT, rounding=ROUND_HALF_UP)
+    if abs(amount) >= _AMOUNT_LIMIT:
+        return None
+    return amount
+
+
+def _is_duplicate(key: Tuple[Any, ...]) -> bool:
+    """
+    Такой же постбэк уже записан в БД за последние POSTBACK_DEDUP_TTL
+    секунд — ретрай партнёрки.
+    Попутно выкидывает истёкшие ключи.
+    """
+    now = time.monotonic()
+    while _recent_postbacks:
+        oldest = next(iter(_recent_postbacks))
+        if _recent_postbacks[oldest] > now:
+            break
+        del _recent_postbacks[oldest]
+    return key in _recent_postbacks
+
 
+def _remember_postback(key: Tuple[Any, ...]) -> None:
+    if POSTBACK_DEDUP_TTL <= 0:
+        return
+    # ключи лежат в порядке истечения — самый старый всегда первый
+    _recent_postbacks.pop(key, None)
+    _recent_postbacks[key] = time.monotonic() + POSTBACK_DEDUP_TTL
+    if len(_recent_postbacks) > POSTBACK_DEDUP_MAXSIZE:
+        _recent_postbacks.popitem(last=False)
+
+
+async def _claim_postback(key: Tuple[Any, ...]) -> bool:
+    """
+    True — постбэк пишем мы, в конце обязателен _release_postback.
+    False — такой уже записан, партнёрке можно сразу ответить OK.
 
-async def get_or_create_settings() -> Settings:
+    Если такой же постбэк прямо сейчас пишет другой запрос, ждём его итога:
+    OK до commit оригинала нельзя — упади он, партнёрка ретрай уже не пришлёт.
+    Если оригинал упал, пишем сами.
+    """
+    if POSTBACK_DEDUP_TTL <= 0:
+        return True
+    while not _is_duplicate(key):
+        inflight = _inflight_postbacks.get(key)
+        if inflight is None:
+            _inflight_postbacks[key] = asyncio.get_running_loop().create_future()
+            return True
+        # shield: отмена ждущего запроса не должна отменить общий Future
+        await asyncio.shield(inflight)
+    return False
+
+
+def _release_postback(key: Tuple[Any, ...], committed: bool) -> None:
+    inflight = _inflight_postbacks.pop(key, None)
+    # запоминаем до set_result: проснувшиеся ретраи должны увидеть ключ
+    if committed:
+        _remember_postback(key)
+    if inflight is not None:
+        inflight.set_result(committed)
+
+
+async def _load_settings() -> PostbackSettings:
     if db.async_session_maker is None:
         raise RuntimeError("DB session maker is not initialized")
 
     async with db.async_session_maker() as session:
-        result = await session.execute(select(Settings).where(Settings.id == 1))
-        settings: Optional[Settings] = result.scalar_one_or_none()
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
-            await session.commit()
-            await session.refresh(settings)
-        return settings
+        result = await session.execute(_SETTINGS_STMT)
+        settings: Settings = result.scalar_one()
+
+    return PostbackSettings(
+        postbacks_chat_id=settings.postbacks_chat_id,
+        send_postbacks_registration=settings.send_postbacks_registration,
+        send_postbacks_deposit=settings.send_postbacks_deposit,
+        send_postbacks_withdraw=settings.send_postbacks_withdraw,
+        vip_threshold_amount=settings.vip_threshold_amount or Decimal("0"),
+    )
 
 
-async def send_postback_to_group(
-    kind: str,
-    trader_id: str,
-    tg_id: int,
-    amount: Optional[float] = None,
-) -> None:
+async def refresh_settings() -> PostbackSettings:
     """
-    kind: 'registration' | 'deposit' | 'withdraw'
+    Перечитать Settings из БД в память процесса.
     """
-    try:
-        settings = await get_or_create_settings()
-    except Exception as e:
-        logger.error("Failed to load Settings for group postback: %s", e)
-        return
+    global _settings_row
+    _settings_row = await _load_settings()
+    return _settings_row
 
-    chat_id = settings.postbacks_chat_id
-    if not chat_id:
-        return
 
-    if kind == "registration" and not settings.send_postbacks_registration:
-        return
-    if kind == "deposit" and not settings.send_postbacks_deposit:
-        return
-    if kind == "withdraw" and not settings.send_postbacks_withdraw:
-        return
+def get_settings() -> PostbackSettings:
+    """
+    Снимок настроек из памяти — без запроса в БД.
+    """
+    if _settings_row is None:
+        raise RuntimeError("Settings are not loaded")
+    return _settings_row
 
-    if kind == "registration":
-        text = (
-            "📝 <b>Регистрация</b>\n"
-            f"trader_id: <code>{trader_id}</code>\n"
-            f"tg_id: <code>{tg_id}</code>\n"
-        )
-    elif kind == "deposit":
-        text = (
-            "💰 <b>Депозит</b>\n"
-            f"trader_id: <code>{trader_id}</code>\n"
-            f"tg_id: <code>{tg_id}</code>\n"
-            f"sumdep: <b>{amount:.2f}$</b>\n"
-        )
-    else:  # withdraw
-        text = (
-            "💸 <b>Вывод средств</b>\n"
-            f"trader_id: <code>{trader_id}</code>\n"
-            f"tg_id: <code>{tg_id}</code>\n"
-            f"wdr_sum: <b>{amount:.2f}$</b>\n"
-        )
 
-    try:
-        await bot.send_message(chat_id, text)
-    except Exception as e:
-        logger.error("Failed to send postback to group: %s", e)
+async def _settings_refresher() -> None:
+    """
+    Перечитывает настройки по NOTIFY из админки или по таймеру.
+    Если БД недоступна — остаёмся на прошлом снимке.
+    """
+    while True:
+        try:
+            await asyncio.wait_for(_settings_changed.wait(), SETTINGS_REFRESH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _settings_changed.clear()
+
+        try:
+            await refresh_settings()
+        except SQLAlchemyError as e:
+            logger.error("Failed to refresh Settings: %s", e)
+        except Exception:
+            # например, голый OSError драйвера при рестарте БД — цикл живёт
+            logger.exception("Unexpected error while refreshing Settings")
+
+
+def _on_settings_notify(connection, pid, channel, payload) -> None:
+    # колбэк asyncpg синхронный — только будим _settings_refresher
+    _settings_changed.set()
 
 
-async def extract_params(request: Request) -> Dict[str, Any]:
+async def _listen_settings_updates() -> Optional[Any]:
     """
-    Собираем параметры из query, form и json.
-    Логируем всё, чтобы видеть, что реально шлёт партнёрка.
+    Postgres (asyncpg): отдельное соединение с LISTEN на канал настроек.
+    Открывается напрямую через asyncpg, мимо пула engine: иначе оно навсегда
+    занимало бы слот, рассчитанный на запросы (см. DB_MAX_CONNECTIONS).
+    Для остальных БД — None, хватает перечитывания по таймеру.
     """
-    params: Dict[str, Any] = {}
+    if db.engine is None or db.engine.dialect.driver != "asyncpg":
+        return None
 
-    # query
-    for k, v in request.query_params.items():
-        params[k] = v
+    import asyncpg  # есть, раз engine работает на asyncpg
 
-    logger.info(
-        "Incoming %s %s from %s | query=%s | headers=%s",
-        request.method,
-        request.url,
-        request.client.host if request.client else "unknown",
-        dict(request.query_params),
-        dict(request.headers),
+    dsn = db.engine.url.set(drivername="postgresql").render_as_string(
+        hide_password=False
     )
+    conn = await asyncpg.connect(dsn)
+    await conn.add_listener(SETTINGS_UPDATED_CHANNEL, _on_settings_notify)
+    return conn
+
+
+def _should_notify(kind: str) -> bool:
+    """
+    Включены ли сообщения в группу для этого события (флаг send_postbacks_<kind>).
+    """
+    settings = get_settings()
+    return bool(settings.postbacks_chat_id) and getattr(settings, f"send_postbacks_{kind}")
+
+
+def send_postback_to_group(
+    kind: str,
+    trader_id: str,
+    tg_id: int,
+    amount: Optional[Decimal] = None,
+) -> None:
+    """
+    kind: 'registration' | 'deposit' | 'withdraw'
+
+    Без I/O: настройки из памяти, отправка — через очередь воркера.
+    Текст собирает воркер (_render_postback), а не обработчик запроса.
+    """
+    if not _should_notify(kind):
+        return
 
-    raw_body: bytes = b""
     try:
-        raw_body = await request.body()
-        if raw_body:
-            logger.info("Raw body: %s", raw_body.decode(errors="ignore"))
-    except Exception as e:
-        logger.error("Error reading body: %s", e)
+        _notify_queue.put_nowait({
+            "chat_id": get_settings().postbacks_chat_id,
+            "kind": kind,
+            "trader_id": trader_id,
+            "tg_id": tg_id,
+            "amount": amount,
+        })
+    except asyncio.QueueFull:
+        logger.error("Postback notify queue is full, message dropped: %s", kind)
+
+
+def _render_postback(msg: Dict[str, Any]) -> str:
+    """
+    HTML-текст сообщения в группу для элемента очереди.
+    """
+    # trader_id приходит от партнёрки — экранируем, иначе один «<» ломает
+    # HTML всей пачки сообщений
+    trader_id = html.escape(msg["trader_id"])
+    if msg["amount"] is None:
+        args: Tuple[Any, ...] = (trader_id, msg["tg_id"])
+    else:
+        args = (trader_id, msg["tg_id"], format(msg["amount"], ".2f"))
+    return _TPL_POSTBACK[msg["kind"]] % args
+
+
+async def _notify_worker() -> None:
+    """
+    Разбирает очередь сообщений в группу. Всё, что накопилось в очереди
+    для того же чата, склеивает в одно сообщение (до NOTIFY_BATCH_LIMIT
+    символов) — под нагрузкой это один sendMessage вместо десятков.
+    На 429 ждёт retry_after и повторяет ту же пачку, чтобы не нарушать порядок.
+    """
+    # сообщение, не влезшее в прошлую пачку, — начало следующей
+    pending: Optional[Tuple[str, str]] = None
+    while True:
+        if pending is not None:
+            chat_id, text = pending
+            pending = None
+        else:
+            msg = await _notify_queue.get()
+            chat_id, text = msg["chat_id"], _render_postback(msg)
+
+        parts = [text]
+        size = len(text)
+        while not _notify_queue.empty():
+            nxt = _notify_queue.get_nowait()
+            text = _render_postback(nxt)
+            if nxt["chat_id"] != chat_id or size + 1 + len(text) > NOTIFY_BATCH_LIMIT:
+                pending = (nxt["chat_id"], text)
+                break
+            parts.append(text)
+            size += 1 + len(text)
+
+        try:
+            while True:
+                try:
+                    await bot.send_message(
+                        chat_id,
+                        # шаблоны кончаются на \n — между записями пустая строка
+                        "\n".join(parts),
+                        link_preview_options=_NO_LINK_PREVIEW,
+                        disable_notification=True,
+                    )
+                    break
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+        except TelegramAPIError as e:
+            # бота убрали из группы, неверный chat_id, сеть — сообщение теряем
+            logger.error("Failed to send postback to group: %s", e)
+        except Exception:
+            # что угодно ещё (не-JSON ответ прокси и т.п.) — воркер не должен
+            # умирать, иначе очередь так и не разберётся
+            logger.exception("Unexpected error while sending postback to group")
+        finally:
+            for _ in parts:
+                _notify_queue.task_done()
+
+
+async def read_body_params(request: Request) -> Dict[str, Any]:
+    """
+    Параметры POST-постбэка: query + тело (form или json), query в приоритете.
+    GET-постбэки сюда не попадают — у них типизированные Query-параметры.
+    """
+    params: Dict[str, Any] = dict(request.query_params)
 
     ct = (request.headers.get("content-type") or "").lower()
+    body: Any = None
     try:
         if "application/x-www-form-urlencoded" in ct or "multipart/form-data" in ct:
-            form = await request.form()
-            form_dict = {k: v for k, v in form.items()}
-            logger.info("Parsed form: %s", form_dict)
-            for k, v in form_dict.items():
-                if k not in params:
-                    params[k] = v
-        elif "application/json" in ct and raw_body:
-            try:
-                json_data = await request.json()
-                if isinstance(json_data, dict):
-                    logger.info("Parsed json: %s", json_data)
-                    for k, v in json_data.items():
-                        if k not in params:
-                            params[k] = v
-            except Exception as e:
-                logger.error("Error parsing json: %s", e)
+            body = await request.form()
+        elif "application/json" in ct:
+            raw = await request.body()
+            if raw:  # пустое тело с JSON content-type — не ошибка, просто нет полей
+                body = orjson.loads(raw)
     except Exception as e:
-        logger.error("Error parsing structured body (form/json): %s", e)
+        logger.error("Error parsing postback body (%s): %s", ct, e)
+
+    if body is not None and hasattr(body, "items"):
+        for k, v in body.items():
+            params.setdefault(k, v)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Incoming %s %s from %s | params=%s | headers=%s",
+            request.method,
+            request.url,
+            request.client.host if request.client else "unknown",
+            params,
+            dict(request.headers),
+        )
 
-    logger.info("Final extracted params: %s", params)
     return params
 
 
 # -------------------------------------------------
-# Startup
+# Startup / shutdown
 # -------------------------------------------------
 
-@app.on_event("startup")
-async def on_startup() -> None:
+# соединения процесса вне пула: LISTEN настроек (см. _listen_settings_updates)
+_DB_CONNECTIONS_OUTSIDE_POOL = 1
+
+
+def _db_pool_kwargs() -> Dict[str, int]:
+    """
+    Под gunicorn у каждого воркера свой пул: общий лимит соединений
+    (DB_MAX_CONNECTIONS) делим на число воркеров (WEB_CONCURRENCY),
+    из доли воркера вычитаем соединения вне пула. Бюджет, которого
+    не хватает хотя бы на одно соединение пула на воркер, — ошибка конфига.
+    """
+    db_max_connections = os.getenv("DB_MAX_CONNECTIONS")
+    if not db_max_connections:
+        return {}
+
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    pool_size = int(db_max_connections) // workers - _DB_CONNECTIONS_OUTSIDE_POOL
+    if pool_size < 1:
+        raise RuntimeError(
+            f"DB_MAX_CONNECTIONS={db_max_connections} is too small for "
+            f"WEB_CONCURRENCY={workers}: need at least "
+            f"{workers * (1 + _DB_CONNECTIONS_OUTSIDE_POOL)}"
+        )
+    return {"pool_size": pool_size, "max_overflow": 0}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    global _notify_worker_task, _settings_refresh_task, _settings_listener_conn
+
     db_url = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./bot.db")
     logger.info("Initializing DB for postback app, url=%s", db_url)
-    db.setup_db(db_url)
+
+    # постбэков много и каждый — отдельный commit: не ждём fsync на каждом
+    db.setup_db(db_url, async_commit=True, **_db_pool_kwargs())
+    # init_db создаёт строку настроек — поэтому он до прогрева, а не в gather
     await db.init_db()
+    await asyncio.gather(db.warm_up_pool(), refresh_settings())
+
+    _settings_listener_conn = await _listen_settings_updates()
+    _settings_refresh_task = asyncio.create_task(_settings_refresher())
+    _notify_worker_task = asyncio.create_task(_notify_worker())
+
     logger.info("Postback app startup complete")
 
+    yield
+
+    # даём воркеру дослать то, что уже в очереди
+    try:
+        await asyncio.wait_for(_notify_queue.join(), timeout=5)
+    except asyncio.TimeoutError:
+        logger.warning("Postback notify queue not drained: %s left", _notify_queue.qsize())
+
+    _notify_worker_task.cancel()
+    _settings_refresh_task.cancel()
+    if _settings_listener_conn is not None:
+        await _settings_listener_conn.close()
+
+    await bot.session.close()
+
+
+app = FastAPI(title="Jogoto postbacks", lifespan=lifespan)
+
 
 # -------------------------------------------------
 # Healthcheck
 # -------------------------------------------------
 
-@app.get("/", response_class=PlainTextResponse)
-async def root() -> str:
-    return '{"status":"ok","service":"postbacks"}'
+# ответ не меняется — собираем один раз и отдаём тот же объект
+_HEALTH = Response(
+    content=b'{"status":"ok","service":"postbacks"}',
+    media_type="application/json",
+    headers={"cache-control": "no-store"},
+)
+
+
+@app.get("/")
+async def root() -> Response:
+    return _HEALTH
 
 
 # -------------------------------------------------
-# /postback/registration
+# registration
 # -------------------------------------------------
 
-@app.get("/postback/registration")
-@app.post("/postback/registration")
-async def postback_registration(request: Request):
+async def _run_access_flow(tg_id: int, became_vip: bool = False) -> None:
+    """
+    Выдача доступов юзеру (и сообщение о VIP). Одновременно — не больше
+    ACCESS_FLOW_CONCURRENCY: при всплеске постбэков остальные ждут очереди,
+    а не забивают event loop и лимиты Bot API.
+    """
+    async with _access_flow_sem:
+        try:
+            await run_access_flow_for_user(bot, tg_id)
+        except TelegramForbiddenError:
+            # юзер заблокировал бота — обычная ситуация, не ошибка
+            logger.debug("User %s blocked the bot", tg_id)
+            return
+        except (TelegramAPIError, SQLAlchemyError) as e:
+            logger.error("run_access_flow_for_user error for %s: %s", tg_id, e)
+
+        if became_vip:
+            try:
+                await notify_vip_granted(bot, tg_id)
+            except TelegramForbiddenError:
+                logger.debug("User %s blocked the bot", tg_id)
+            except (TelegramAPIError, SQLAlchemyError) as e:
+                logger.error("notify_vip_granted error: %s", e)
+
+
+async def _after_registration(tg_id: int, trader_id: str) -> None:
+    """
+    Выполняется после ответа партнёрке (BackgroundTasks).
+    Сообщение в группу — сразу, не дожидаясь очереди на доступы.
+    """
+    send_postback_to_group("registration", trader_id, tg_id)
+    await _run_access_flow(tg_id)
+
+
+async def _handle_registration(
+    background_tasks: BackgroundTasks,
+    trader_id: Optional[str],
+    click_id: Optional[str],
+):
     """
     Регистрация:
     trader_id={trader_id}
     click_id={click_id}  (tg id)
     """
-    await check_secret(request)
-    params = await extract_params(request)
-
-    trader_id = params.get("trader_id")
-    click_id = params.get("click_id")
-
     if not trader_id or not click_id:
-        logger.warning("Missing trader_id or click_id in registration: %s", params)
+        logger.warning(
+            "Missing trader_id or click_id in registration: trader_id=%s click_id=%s",
+            trader_id,
+            click_id,
+        )
         return PlainTextResponse("MISSING_PARAMS", status_code=200)
 
-    try:
-        tg_id = int(str(click_id))
-    except ValueError:
+    tg_id = _parse_click_id(click_id)
+    if tg_id is None:
         logger.warning("Invalid click_id for registration: %s", click_id)
         return PlainTextResponse("BAD_CLICK_ID", status_code=200)
 
     logger.info(
-        "POSTBACK registration parsed: trader_id=%s click_id=%s (tg_id=%s)",
-        trader_id,
-        click_id,
-        tg_id,
+        "postback",
+        extra={"event": "registration", "trader_id": trader_id, "tg_id": tg_id},
     )
 
     if db.async_session_maker is None:
-        raise HTTPException(status_code=500, detail="DB not initialized")
+        raise _ERR_DB_NOT_INITIALIZED.with_traceback(None)
 
-    async with db.async_session_maker() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == tg_id)
-        )
-        user: Optional[User] = result.scalar_one_or_none()
-        if user is None:
-            user = User(telegram_id=tg_id)
-            session.add(user)
-
-        user.trader_id = str(trader_id)
-        user.is_registered = True
-
-        await session.commit()
+    dedup_key = ("registration", str(trader_id), tg_id)
+    if not await _claim_postback(dedup_key):
+        logger.info("Duplicate registration postback skipped: tg_id=%s", tg_id)
+        return PlainTextResponse("OK")
 
+    committed = False
     try:
-        await run_access_flow_for_user(bot, tg_id)
-    except Exception as e:
-        logger.error("run_access_flow_for_user error after registration: %s", e)
+        async with db.async_session_maker() as session:
+            insert = db.dialect_insert(session.bind.dialect.name)
+            stmt = insert(User).values(
+                telegram_id=tg_id,
+                trader_id=str(trader_id),
+                is_registered=True,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.telegram_id],
+                set_={
+                    "trader_id": stmt.excluded.trader_id,
+                    "is_registered": True,
+                    "updated_at": func.now(),
+                },
+            )
+            await session.execute(stmt)
+            await session.commit()
+        committed = True
+    finally:
+        _release_postback(dedup_key, committed)
 
-    await send_postback_to_group("registration", str(trader_id), tg_id)
+    # доступы и сообщения в Telegram — уже после ответа партнёрке
+    background_tasks.add_task(_after_registration, tg_id, str(trader_id))
 
     return PlainTextResponse("OK")
 
 
 # -------------------------------------------------
-# /postback/first_deposit и /postback/redeposit
+# first_deposit и redeposit
 # -------------------------------------------------
 
+async def _after_deposit(
+    tg_id: int,
+    trader_id: str,
+    sumdep: Decimal,
+    became_vip: bool,
+) -> None:
+    """
+    Выполняется после ответа партнёрке (BackgroundTasks).
+    """
+    send_postback_to_group("deposit", trader_id, tg_id, amount=sumdep)
+    await _run_access_flow(tg_id, became_vip)
+
+
 async def _handle_deposit_common(
-    request: Request,
     event_name: str,
+    background_tasks: BackgroundTasks,
+    trader_id: Optional[str],
+    click_id: Optional[str],
+    sumdep_raw: Any,
 ):
-    await check_secret(request)
-    params = await extract_params(request)
-
-    trader_id = params.get("trader_id")
-    click_id = params.get("click_id")
-    sumdep_raw = params.get("sumdep")
-
     if not trader_id or not click_id or sumdep_raw is None:
         logger.warning(
-            "Missing params in %s: %s",
+            "Missing params in %s: trader_id=%s click_id=%s sumdep=%s",
             event_name,
-            params,
+            trader_id,
+            click_id,
+            sumdep_raw,
         )
         return PlainTextResponse("MISSING_PARAMS", status_code=200)
 
-    try:
-        tg_id = int(str(click_id))
-    except ValueError:
+    tg_id = _parse_click_id(click_id)
+    if tg_id is None:
         logger.warning("Invalid click_id for %s: %s", event_name, click_id)
         return PlainTextResponse("BAD_CLICK_ID", status_code=200)
 
-    try:
-        sumdep = float(str(sumdep_raw).replace(",", "."))
-    except ValueError:
+    sumdep = _parse_amount(sumdep_raw)
+    if sumdep is None:
         logger.warning("Invalid sumdep for %s: %s", event_name, sumdep_raw)
         return PlainTextResponse("BAD_SUMDEP", status_code=200)
 
     logger.info(
-        "POSTBACK %s parsed: trader_id=%s click_id=%s (tg_id=%s) sumdep=%s",
-        event_name,
-        trader_id,
-        click_id,
-        tg_id,
-        sumdep,
+        "postback",
+        extra={
+            "event": event_name,
+            "trader_id": trader_id,
+            "tg_id": tg_id,
+            "amount": sumdep,
+        },
     )
 
     if db.async_session_maker is None:
-        raise HTTPException(status_code=500, detail="DB not initialized")
-
-    became_vip = False
-
-    async with db.async_session_maker() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == tg_id)
-        )
-        user: Optional[User] = result.scalar_one_or_none()
-        if user is None:
-            user = User(telegram_id=tg_id)
-            session.add(user)
-
-        if trader_id and not user.trader_id:
-            user.trader_id = str(trader_id)
-
-        dep = Deposit(user_id=user.id, amount=float(sumdep))
-        session.add(dep)
-
-        total_dep = await session.scalar(
-            select(func.coalesce(func.sum(Deposit.amount), 0.0)).where(
-                Deposit.user_id == user.id
-            )
-        )
-        total_dep = float(total_dep or 0.0)
+        raise _ERR_DB_NOT_INITIALIZED.with_traceback(None)
 
-        settings = await session.get(Settings, 1)
-        if settings is None:
-            settings = Settings(id=1)
-            session.add(settings)
+    settings = get_settings()
 
-        vip_threshold = float(settings.vip_threshold_amount or 0.0)
-
-        if vip_threshold > 0 and total_dep >= vip_threshold and not user.is_vip:
-            user.is_vip = True
-            became_vip = True
-
-        await session.commit()
+    # Повтор отсекаем только для first_deposit: он бывает у юзера один раз.
+    # Два redeposit на одну сумму — обычное дело, их пишем всегда.
+    dedup_key: Optional[Tuple[Any, ...]] = None
+    if event_name == "first_deposit":
+        dedup_key = (event_name, str(trader_id), tg_id, sumdep)
+        if not await _claim_postback(dedup_key):
+            logger.info("Duplicate %s postback skipped: tg_id=%s", event_name, tg_id)
+            return PlainTextResponse("OK")
 
+    committed = False
     try:
-        await run_access_flow_for_user(bot, tg_id)
-    except Exception as e:
-        logger.error("run_access_flow_for_user error after deposit: %s", e)
+        async with db.async_session_maker() as session:
+            # Один UPSERT: создаём юзера, если его нет; trader_id проставляем,
+            # только если пуст; сразу прибавляем сумму к users.total_deposits.
+            # is_vip здесь не трогаем — RETURNING отдаёт его значение до депозита.
+            dialect_name = session.bind.dialect.name
+            insert = db.dialect_insert(dialect_name)
+            stmt = insert(User).values(
+                telegram_id=tg_id,
+                trader_id=str(trader_id),
+                total_deposits=sumdep,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.telegram_id],
+                set_={
+                    "trader_id": func.coalesce(
+                        func.nullif(User.trader_id, ""), stmt.excluded.trader_id
+                    ),
+                    "total_deposits": User.total_deposits + stmt.excluded.total_deposits,
+                    "updated_at": func.now(),
+                },
+            ).returning(User.id, User.is_vip, User.total_deposits)
+
+            if dialect_name == "postgresql":
+                # Postgres: UPSERT и INSERT депозита — одним запросом через CTE
+                upserted = stmt.cte("u")
+                add_deposit = (
+                    insert(Deposit)
+                    .from_select(
+                        ["user_id", "amount"],
+                        select(upserted.c.id, literal(sumdep, Deposit.amount.type)),
+                    )
+                    .cte("d")
+                )
+                stmt = select(
+                    upserted.c.id, upserted.c.is_vip, upserted.c.total_deposits
+                ).add_cte(add_deposit)
+                user_id, is_vip, total_dep = (await session.execute(stmt)).one()
+            else:
+                # SQLite не умеет INSERT внутри WITH — два запроса в одной транзакции
+                user_id, is_vip, total_dep = (await session.execute(stmt)).one()
+                # INSERT депозита без ORM-объекта: id строки нам не нужен
+                await session.execute(
+                    insert(Deposit).values(user_id=user_id, amount=sumdep)
+                )
+
+            # Отдельный UPDATE — только в момент перехода через VIP-порог.
+            # Условие is_vip = false: из двух параллельных депозитов VIP «выдаст» один.
+            became_vip = False
+            vip_threshold = settings.vip_threshold_amount
+            if vip_threshold > 0 and not is_vip and total_dep >= vip_threshold:
+                result = await session.execute(
+                    update(User)
+                    .where(User.id == user_id, User.is_vip.is_(False))
+                    .values(is_vip=True)
+                    .execution_options(synchronize_session=False)
+                )
+                became_vip = result.rowcount == 1
 
-    if became_vip:
-        try:
-            await notify_vip_granted(bot, tg_id)
-        except Exception as e:
-            logger.error("notify_vip_granted error: %s", e)
+            await session.commit()
+        committed = True
+    finally:
+        if dedup_key is not None:
+            _release_postback(dedup_key, committed)
 
-    await send_postback_to_group("deposit", str(trader_id), tg_id, amount=float(sumdep))
+    background_tasks.add_task(
+        _after_deposit, tg_id, str(trader_id), sumdep, became_vip
+    )
 
     return PlainTextResponse("OK")
 
 
-@app.get("/postback/first_deposit")
-@app.post("/postback/first_deposit")
-async def postback_first_deposit(request: Request):
-    return await _handle_deposit_common(request=request, event_name="first_deposit")
-
-
-@app.get("/postback/redeposit")
-@app.post("/postback/redeposit")
-async def postback_redeposit(request: Request):
-    return await _handle_deposit_common(request=request, event_name="redeposit")
-
-
 # -------------------------------------------------
-# /postback/withdraw
+# withdraw
 # -------------------------------------------------
 
-@app.get("/postback/withdraw")
-@app.post("/postback/withdraw")
-async def postback_withdraw(request: Request):
-    await check_secret(request)
-    params = await extract_params(request)
-
-    trader_id = params.get("trader_id")
-    click_id = params.get("click_id")
-    wdr_raw = params.get("wdr_sum")
-
+async def _handle_withdraw(
+    background_tasks: BackgroundTasks,
+    trader_id: Optional[str],
+    click_id: Optional[str],
+    wdr_raw: Any,
+):
     if not trader_id or not click_id or wdr_raw is None:
-        logger.warning("Missing params in withdraw: %s", params)
+        logger.warning(
+            "Missing params in withdraw: trader_id=%s click_id=%s wdr_sum=%s",
+            trader_id,
+            click_id,
+            wdr_raw,
+        )
         return PlainTextResponse("MISSING_PARAMS", status_code=200)
 
-    try:
-        tg_id = int(str(click_id))
-    except ValueError:
+    tg_id = _parse_click_id(click_id)
+    if tg_id is None:
         logger.warning("Invalid click_id for withdraw: %s", click_id)
         return PlainTextResponse("BAD_CLICK_ID", status_code=200)
 
-    try:
-        wdr_sum = float(str(wdr_raw).replace(",", "."))
-    except ValueError:
+    wdr_sum = _parse_amount(wdr_raw)
+    if wdr_sum is None:
         logger.warning("Invalid wdr_sum for withdraw: %s", wdr_raw)
         return PlainTextResponse("BAD_WDR_SUM", status_code=200)
 
     logger.info(
-        "POSTBACK withdraw parsed: trader_id=%s click_id=%s (tg_id=%s) wdr_sum=%s",
-        trader_id,
-        click_id,
-        tg_id,
-        wdr_sum,
+        "postback",
+        extra={
+            "event": "withdraw",
+            "trader_id": trader_id,
+            "tg_id": tg_id,
+            "amount": wdr_sum,
+        },
     )
 
-    await send_postback_to_group("withdraw", str(trader_id), tg_id, amount=float(wdr_sum))
+    send_postback_to_group("withdraw", str(trader_id), tg_id, amount=wdr_sum)
 
     return PlainTextResponse("OK")
 
 
+# -------------------------------------------------
+# Роуты /postback/<event>
+# -------------------------------------------------
+
+# event -> (обработчик, какие параметры ему передать по порядку);
+# первым аргументом обработчик получает BackgroundTasks
+POSTBACK_EVENTS: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...]]] = {
+    "registration": (
+        _handle_registration,
+        ("trader_id", "click_id"),
+    ),
+    "first_deposit": (
+        partial(_handle_deposit_common, "first_deposit"),
+        ("trader_id", "click_id", "sumdep"),
+    ),
+    "redeposit": (
+        partial(_handle_deposit_common, "redeposit"),
+        ("trader_id", "click_id", "sumdep"),
+    ),
+    "withdraw": (
+        _handle_withdraw,
+        ("trader_id", "click_id", "wdr_sum"),
+    ),
+}
+
+
+def _make_get_endpoint(
+    handler: Callable[..., Awaitable[Any]],
+    fields: Tuple[str, ...],
+) -> Callable[[Request, BackgroundTasks], Awaitable[Any]]:
+    """
+    GET: параметры только из query — тело не читаем.
+    """
+    async def endpoint(request: Request, background_tasks: BackgroundTasks):
+        query = request.query_params
+        return await handler(background_tasks, *(query.get(name) for name in fields))
+
+    return endpoint
+
+
+def _make_post_endpoint(
+    handler: Callable[..., Awaitable[Any]],
+    fields: Tuple[str, ...],
+) -> Callable[[Request, BackgroundTasks], Awaitable[Any]]:
+    """
+    POST: query + form/json (для партнёрок, которые шлют тело).
+    """
+    async def endpoint(request: Request, background_tasks: BackgroundTasks):
+        params = await read_body_params(request)
+        return await handler(background_tasks, *(params.get(name) for name in fields))
+
+    return endpoint
+
+
+# регистрируем до catch-all, иначе /postback/{tail:path} перехватит всё
+for _event, (_handler, _fields) in POSTBACK_EVENTS.items():
+    app.add_api_route(
+        f"/postback/{_event}",
+        _make_get_endpoint(_handler, _fields),
+        methods=["GET"],
+        name=f"postback_{_event}",
+        dependencies=_SECRET_CHECK,
+    )
+    app.add_api_route(
+        f"/postback/{_event}",
+        _make_post_endpoint(_handler, _fields),
+        methods=["POST"],
+        name=f"postback_{_event}_post",
+        dependencies=_SECRET_CHECK,
+    )
+
+
 # -------------------------------------------------
 # CATCH-ALL /postback/*
 # -------------------------------------------------
@@ -437,6 +997,26 @@ async def postback_catch_all(tail: str, request: Request):
     На случай, если в партнёрке путь кривой (например /postback/reg или просто /postback).
     Мы это логируем и отвечаем OK, чтобы увидеть, что вообще прилетело.
     """
-    params = await extract_params(request)
-    logger.info("CATCH-ALL /postback/%s params=%s", tail, params)
-    return PlainTextResponse("OK (catch-all)")
\ No newline at end of file
+    # тело разбираем только ради лога — если INFO выключен, не тратимся
+    if logger.isEnabledFor(logging.INFO):
+        params = await read_body_params(request)
+        logger.info("CATCH-ALL /postback/%s params=%s", tail, params)
+    return PlainTextResponse("OK (catch-all)")
+
+
+# -------------------------------------------------
+# Запуск: python postback_app.py
+# (то же самое: uvicorn postback_app:app). loop/http="auto": uvloop и
+# httptools, если установлены (uvicorn[standard]), иначе asyncio и h11
+# -------------------------------------------------
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=os.getenv("POSTBACK_HOST", "0.0.0.0"),
+        port=int(os.getenv("POSTBACK_PORT", "8000")),
+        loop="auto",
+        http="auto",
+    )
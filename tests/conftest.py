@@ -0,0 +1,51 @@
+import asyncio
+import os
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+# postback_app читает окружение при импорте: токен обязателен, секрет
+# пустой — тесты ходят в роуты без ?secret=. Выставляем до load_dotenv,
+# чтобы значения из .env их не перебили.
+os.environ["BOT_TOKEN"] = "123456:TEST"
+os.environ["BROKER_POSTBACK_SECRET"] = ""
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """
+    Постбэк-приложение на временной SQLite-БД, Telegram заглушен.
+    client.vip_granted — кому «выдали» VIP.
+    """
+    from fastapi.testclient import TestClient
+
+    import postback_app as pa
+    from bot.models import base as db
+
+    monkeypatch.setenv("DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.delenv("DB_MAX_CONNECTIONS", raising=False)
+    # объекты asyncio модуля привязываются к циклу первого TestClient
+    monkeypatch.setattr(pa, "_notify_queue", asyncio.Queue())
+    monkeypatch.setattr(pa, "_settings_changed", asyncio.Event())
+    monkeypatch.setattr(pa, "_recent_postbacks", OrderedDict())
+
+    vip_granted = []
+
+    async def noop(*args, **kwargs):
+        pass
+
+    async def fake_notify_vip(bot, tg_id):
+        vip_granted.append(tg_id)
+
+    monkeypatch.setattr(pa.bot, "send_message", noop)
+    monkeypatch.setattr(pa, "run_access_flow_for_user", noop)
+    monkeypatch.setattr(pa, "notify_vip_granted", fake_notify_vip)
+
+    with TestClient(pa.app) as c:
+        c.vip_granted = vip_granted
+        yield c
+        c.portal.call(db.engine.dispose)
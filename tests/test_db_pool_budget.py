@@ -0,0 +1,37 @@
+import pytest
+
+import postback_app as pa
+
+
+@pytest.mark.parametrize(
+    "budget, workers, pool_size",
+    [
+        ("20", "1", 19),
+        ("20", "4", 4),
+        # остаток от деления не раздаём: 4 * (2 + 1) <= 13
+        ("13", "4", 2),
+        ("8", "4", 1),
+    ],
+)
+def test_pool_split_reserves_listener(monkeypatch, budget, workers, pool_size):
+    monkeypatch.setenv("DB_MAX_CONNECTIONS", budget)
+    monkeypatch.setenv("WEB_CONCURRENCY", workers)
+
+    kwargs = pa._db_pool_kwargs()
+    assert kwargs == {"pool_size": pool_size, "max_overflow": 0}
+    total = int(workers) * (kwargs["pool_size"] + pa._DB_CONNECTIONS_OUTSIDE_POOL)
+    assert total <= int(budget)
+
+
+@pytest.mark.parametrize("budget, workers", [("7", "4"), ("3", "4"), ("1", "1")])
+def test_budget_below_workers_is_rejected(monkeypatch, budget, workers):
+    monkeypatch.setenv("DB_MAX_CONNECTIONS", budget)
+    monkeypatch.setenv("WEB_CONCURRENCY", workers)
+
+    with pytest.raises(RuntimeError, match="DB_MAX_CONNECTIONS"):
+        pa._db_pool_kwargs()
+
+
+def test_no_budget_keeps_default_pool(monkeypatch):
+    monkeypatch.delenv("DB_MAX_CONNECTIONS", raising=False)
+    assert pa._db_pool_kwargs() == {}
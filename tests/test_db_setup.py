@@ -0,0 +1,11 @@
+import pytest
+
+from bot.models import base as db
+
+
+def test_old_sqlite_is_rejected(monkeypatch, tmp_path):
+    monkeypatch.setattr(db.sqlite3, "sqlite_version_info", (3, 34, 1))
+    monkeypatch.setattr(db.sqlite3, "sqlite_version", "3.34.1")
+
+    with pytest.raises(RuntimeError, match="3.34.1 is too old"):
+        db.setup_db(f"sqlite+aiosqlite:///{tmp_path / 'old.db'}")
@@ -0,0 +1,16 @@
+import logging
+
+import pytest
+
+from bot.logging_setup import configure
+
+
+@pytest.mark.parametrize("level", ["info", "INFO", " Warning "])
+def test_level_name_is_case_insensitive(monkeypatch, level):
+    root = logging.getLogger()
+    # configure ничего не делает, если у root уже есть хендлеры
+    monkeypatch.setattr(root, "handlers", [])
+    monkeypatch.setattr(root, "level", root.level)
+
+    configure(level)
+    assert root.level == logging.getLevelName(level.strip().upper())
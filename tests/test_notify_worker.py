@@ -0,0 +1,100 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+import postback_app as pa
+
+
+def _msg(chat_id, tg_id, kind="registration", trader_id="t", amount=None):
+    return {
+        "chat_id": chat_id,
+        "kind": kind,
+        "trader_id": trader_id,
+        "tg_id": tg_id,
+        "amount": amount,
+    }
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    calls = []
+
+    async def fake_send(chat_id, text, **kwargs):
+        calls.append((chat_id, text))
+
+    monkeypatch.setattr(pa.bot, "send_message", fake_send)
+    return calls
+
+
+def _run_worker(monkeypatch, messages):
+    """
+    Складывает messages в свежую очередь, запускает воркер и ждёт,
+    пока он разберёт всё. Очередь создаётся внутри цикла теста:
+    модульная привязалась бы к чужому event loop.
+    """
+    async def run():
+        queue = asyncio.Queue()
+        monkeypatch.setattr(pa, "_notify_queue", queue)
+        for msg in messages:
+            queue.put_nowait(msg)
+        worker = asyncio.create_task(pa._notify_worker())
+        try:
+            await asyncio.wait_for(queue.join(), timeout=5)
+        finally:
+            worker.cancel()
+
+    asyncio.run(run())
+
+
+def test_same_chat_is_sent_as_one_batch(monkeypatch, sent):
+    messages = [_msg("-100", tg_id) for tg_id in (1, 2, 3)]
+    _run_worker(monkeypatch, messages)
+
+    assert sent == [("-100", "\n".join(pa._render_postback(m) for m in messages))]
+
+
+def test_chat_switch_starts_new_batch_in_order(monkeypatch, sent):
+    messages = [_msg("-1", 1), _msg("-1", 2), _msg("-2", 3), _msg("-1", 4)]
+    _run_worker(monkeypatch, messages)
+
+    assert [chat_id for chat_id, _ in sent] == ["-1", "-2", "-1"]
+    texts = [text for _, text in sent]
+    assert texts[0] == "\n".join(pa._render_postback(m) for m in messages[:2])
+    assert texts[1] == pa._render_postback(messages[2])
+    assert texts[2] == pa._render_postback(messages[3])
+
+
+def test_batch_respects_size_limit(monkeypatch, sent):
+    messages = [_msg("-100", tg_id) for tg_id in range(10, 15)]
+    one = len(pa._render_postback(messages[0]))
+    # влезают ровно две записи с разделителем
+    monkeypatch.setattr(pa, "NOTIFY_BATCH_LIMIT", 2 * one + 1)
+    _run_worker(monkeypatch, messages)
+
+    assert [text.count("<b>Регистрация</b>") for _, text in sent] == [2, 2, 1]
+    assert all(len(text) <= pa.NOTIFY_BATCH_LIMIT for _, text in sent)
+    joined = "\n".join(text for _, text in sent)
+    assert joined == "\n".join(pa._render_postback(m) for m in messages)
+
+
+def test_render_escapes_trader_id_and_formats_amount():
+    text = pa._render_postback(
+        _msg("-100", 5, kind="deposit", trader_id="<b>x", amount=Decimal("7.5"))
+    )
+    assert "<code>&lt;b&gt;x</code>" in text
+    assert "<b>7.50$</b>" in text
+
+
+def test_worker_survives_unexpected_error(monkeypatch):
+    calls = []
+
+    async def flaky_send(chat_id, text, **kwargs):
+        calls.append(chat_id)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(pa.bot, "send_message", flaky_send)
+    _run_worker(monkeypatch, [_msg("-1", 1), _msg("-2", 2)])
+
+    assert calls == ["-1", "-2"]
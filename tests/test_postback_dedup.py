@@ -0,0 +1,168 @@
+import asyncio
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+from fastapi import BackgroundTasks
+from sqlalchemy.exc import SQLAlchemyError
+
+import postback_app as pa
+
+TTL = 100.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Управляемое time.monotonic() и чистая память дедупа на каждый тест.
+    """
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(pa, "time", SimpleNamespace(monotonic=lambda: now.value))
+    monkeypatch.setattr(pa, "_recent_postbacks", OrderedDict())
+    monkeypatch.setattr(pa, "_inflight_postbacks", {})
+    monkeypatch.setattr(pa, "POSTBACK_DEDUP_TTL", TTL)
+    return now
+
+
+def test_duplicate_within_ttl(clock):
+    key = ("registration", "t1", 111)
+    assert not pa._is_duplicate(key)
+    pa._remember_postback(key)
+
+    clock.value += TTL - 1
+    assert pa._is_duplicate(key)
+    assert not pa._is_duplicate(("registration", "t1", 222))
+
+
+def test_expired_keys_are_purged(clock):
+    pa._remember_postback("a")
+    clock.value += 10
+    pa._remember_postback("b")
+
+    clock.value += TTL - 5  # "a" истёк, "b" ещё нет
+    assert not pa._is_duplicate("a")
+    assert list(pa._recent_postbacks) == ["b"]
+    assert pa._is_duplicate("b")
+
+
+def test_remember_again_moves_key_to_the_end(clock):
+    # ключи лежат в порядке истечения: продлённый ключ не должен
+    # остановить очистку тех, что истекают раньше него
+    pa._remember_postback("a")
+    clock.value += 10
+    pa._remember_postback("b")
+    clock.value += 10
+    pa._remember_postback("a")
+    assert list(pa._recent_postbacks) == ["b", "a"]
+
+    clock.value += TTL - 5  # "b" истёк, продлённый "a" — нет
+    assert pa._is_duplicate("a")
+    assert list(pa._recent_postbacks) == ["a"]
+
+
+def test_size_cap_evicts_oldest(clock, monkeypatch):
+    monkeypatch.setattr(pa, "POSTBACK_DEDUP_MAXSIZE", 3)
+    for key in ("a", "b", "c", "d"):
+        pa._remember_postback(key)
+
+    assert list(pa._recent_postbacks) == ["b", "c", "d"]
+    assert not pa._is_duplicate("a")
+
+
+def test_zero_ttl_disables_dedup(clock, monkeypatch):
+    monkeypatch.setattr(pa, "POSTBACK_DEDUP_TTL", 0.0)
+    pa._remember_postback("a")
+    assert not pa._recent_postbacks
+    assert not pa._is_duplicate("a")
+
+
+class _FakeSession:
+    """
+    Сессия без БД: execute отдаёт управление циклу (ретрай успевает прийти,
+    пока запрос в полёте) и падает, если fail.
+    """
+
+    def __init__(self, commits, fail):
+        self.commits = commits
+        self.fail = fail
+        self.bind = SimpleNamespace(dialect=SimpleNamespace(name="sqlite"))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt):
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise SQLAlchemyError("pool timeout")
+
+    async def commit(self):
+        self.commits.append(True)
+
+
+@pytest.fixture
+def sessions(clock, monkeypatch):
+    """
+    Подменяет фабрику сессий; sessions.fail — сколько первых сессий упадёт.
+    """
+    state = SimpleNamespace(opened=0, fail=0, commits=[])
+
+    def maker():
+        state.opened += 1
+        return _FakeSession(state.commits, fail=state.opened <= state.fail)
+
+    monkeypatch.setattr(pa.db, "async_session_maker", maker)
+    return state
+
+
+async def _registration_with_retry():
+    """
+    Оригинал и ретрай партнёрки, пришедший, пока оригинал пишет в БД.
+    """
+    original = asyncio.create_task(
+        pa._handle_registration(BackgroundTasks(), "t1", "111")
+    )
+    await asyncio.sleep(0)  # оригинал занял ключ и ждёт БД
+    retry = await pa._handle_registration(BackgroundTasks(), "t1", "111")
+    return original, retry
+
+
+def test_retry_in_flight_waits_for_commit(sessions):
+    async def run():
+        original, retry = await _registration_with_retry()
+        assert (await original).body == b"OK"
+        return retry
+
+    retry = asyncio.run(run())
+    assert retry.body == b"OK"
+    assert (sessions.opened, len(sessions.commits)) == (1, 1)
+    assert pa._is_duplicate(("registration", "t1", 111))
+
+
+def test_retry_in_flight_is_written_when_original_fails(sessions):
+    # оригинал упал уже после того, как пришёл ретрай: ретрай не должен
+    # получить OK, не записав постбэк
+    sessions.fail = 1
+
+    async def run():
+        original, retry = await _registration_with_retry()
+        with pytest.raises(SQLAlchemyError):
+            await original
+        return retry
+
+    retry = asyncio.run(run())
+    assert retry.body == b"OK"
+    assert (sessions.opened, len(sessions.commits)) == (2, 1)
+    assert pa._is_duplicate(("registration", "t1", 111))
+    assert not pa._inflight_postbacks
+
+
+def test_failed_postback_is_not_remembered(sessions):
+    sessions.fail = 1
+    with pytest.raises(SQLAlchemyError):
+        asyncio.run(pa._handle_registration(BackgroundTasks(), "t1", "111"))
+
+    assert not pa._is_duplicate(("registration", "t1", 111))
+    assert not pa._inflight_postbacks
@@ -0,0 +1,92 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select, update
+
+import postback_app as pa
+from bot.models import base as db
+from bot.models.deposit import Deposit
+from bot.models.settings import Settings
+from bot.models.user import User
+
+VIP_THRESHOLD = Decimal("100")
+
+
+@pytest.fixture
+def vip_client(client):
+    """
+    client с VIP-порогом VIP_THRESHOLD.
+    """
+    async def set_vip_threshold():
+        async with db.async_session_maker() as session:
+            await session.execute(
+                update(Settings)
+                .where(Settings.id == 1)
+                .values(vip_threshold_amount=VIP_THRESHOLD)
+            )
+            await session.commit()
+        await pa.refresh_settings()
+
+    client.portal.call(set_vip_threshold)
+    return client
+
+
+def _deposit(client, event, tg_id, sumdep, trader_id="t1"):
+    r = client.get(
+        f"/postback/{event}",
+        params={"trader_id": trader_id, "click_id": str(tg_id), "sumdep": sumdep},
+    )
+    assert r.status_code == 200
+    return r.text
+
+
+def _user_state(client, tg_id):
+    async def load():
+        async with db.async_session_maker() as session:
+            user = await session.scalar(select(User).where(User.telegram_id == tg_id))
+            deposits = await session.scalar(
+                select(func.count()).select_from(Deposit).where(Deposit.user_id == user.id)
+            )
+            return user, deposits
+
+    return client.portal.call(load)
+
+
+def test_deposits_accumulate_and_flip_vip_once(vip_client):
+    assert _deposit(vip_client, "first_deposit", 111, "60.5") == "OK"
+    user, deposits = _user_state(vip_client, 111)
+    assert (user.total_deposits, user.is_vip, deposits) == (Decimal("60.50"), False, 1)
+    assert vip_client.vip_granted == []
+
+    assert _deposit(vip_client, "redeposit", 111, "50,25") == "OK"
+    user, deposits = _user_state(vip_client, 111)
+    assert (user.total_deposits, user.is_vip, deposits) == (Decimal("110.75"), True, 2)
+    assert vip_client.vip_granted == [111]
+
+    # уже VIP — повторно не выдаём
+    assert _deposit(vip_client, "redeposit", 111, "10") == "OK"
+    user, deposits = _user_state(vip_client, 111)
+    assert (user.total_deposits, user.is_vip, deposits) == (Decimal("120.75"), True, 3)
+    assert vip_client.vip_granted == [111]
+
+
+def test_deposit_creates_missing_user(vip_client):
+    assert _deposit(vip_client, "redeposit", 222, "100", trader_id="t2") == "OK"
+    user, deposits = _user_state(vip_client, 222)
+    assert user.trader_id == "t2"
+    assert (user.total_deposits, user.is_vip, deposits) == (Decimal("100.00"), True, 1)
+    assert vip_client.vip_granted == [222]
+
+
+def test_first_deposit_retry_is_not_counted_twice(client):
+    assert _deposit(client, "first_deposit", 333, "10") == "OK"
+    assert _deposit(client, "first_deposit", 333, "10") == "OK"
+    user, deposits = _user_state(client, 333)
+    assert (user.total_deposits, deposits) == (Decimal("10.00"), 1)
+
+
+def test_same_redeposit_twice_is_counted_twice(client):
+    assert _deposit(client, "redeposit", 444, "10") == "OK"
+    assert _deposit(client, "redeposit", 444, "10") == "OK"
+    user, deposits = _user_state(client, 444)
+    assert (user.total_deposits, deposits) == (Decimal("20.00"), 2)
@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+import pytest
+
+import postback_app as pa
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("12.5", Decimal("12.50")),
+        ("12,5", Decimal("12.50")),
+        (7, Decimal("7.00")),
+        # округление до центов — половина вверх, без float
+        ("2.675", Decimal("2.68")),
+        ("0.005", Decimal("0.01")),
+        ("0.004", Decimal("0.00")),
+        ("-1.005", Decimal("-1.01")),
+        ("9999999999.99", Decimal("9999999999.99")),
+    ],
+)
+def test_parse_amount(raw, expected):
+    amount = pa._parse_amount(raw)
+    assert amount == expected
+    assert amount.as_tuple().exponent == -2
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        "", "abc", "1.2.3", "{sumdep}", None,
+        "nan", "NaN", "sNaN", "inf", "-Infinity",
+        # Numeric(12, 2): 10 знаков до запятой
+        "1e10", "10000000000", "-10000000000",
+        # округляется ровно до 10^10
+        "9999999999.995",
+        # quantize сам по себе упал бы с InvalidOperation
+        "1e40",
+    ],
+)
+def test_parse_amount_rejects(raw):
+    assert pa._parse_amount(raw) is None
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("123", 123),
+        (777, 777),
+        ("0", 0),
+        (str(2**63 - 1), 2**63 - 1),
+    ],
+)
+def test_parse_click_id(raw, expected):
+    assert pa._parse_click_id(raw) == expected
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        "{click_id}", "", "abc", "12a", " 123", "-5", "1.0",
+        # не-ASCII цифры int() принял бы
+        "١٢٣",
+        # за пределами BIGINT
+        str(2**63),
+        "9" * 19,
+        "0" * 19 + "1",
+    ],
+)
+def test_parse_click_id_rejects(raw):
+    assert pa._parse_click_id(raw) is None
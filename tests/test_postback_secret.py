@@ -0,0 +1,66 @@
+import pytest
+
+import postback_app as pa
+
+SECRET = "s3cret"
+URL = "/postback/withdraw"
+
+
+@pytest.fixture
+def secret_client(client, monkeypatch):
+    monkeypatch.setattr(pa, "POSTBACK_SECRET_B", SECRET.encode())
+    return client
+
+
+def _status(client, params=None, headers=None):
+    return client.get(URL, params=params or {}, headers=headers or {}).status_code
+
+
+def test_no_secret_configured_accepts_everything(client):
+    assert _status(client) == 200
+    assert _status(client, params={"secret": "anything"}) == 200
+
+
+def test_valid_query_secret(secret_client):
+    assert _status(secret_client, params={"secret": SECRET}) == 200
+
+
+def test_header_secret_when_query_is_missing(secret_client):
+    assert _status(secret_client, headers={"X-Postback-Secret": SECRET}) == 200
+
+
+def test_query_secret_takes_precedence_over_header(secret_client):
+    assert _status(
+        secret_client,
+        params={"secret": "wrong"},
+        headers={"X-Postback-Secret": SECRET},
+    ) == 403
+    assert _status(
+        secret_client,
+        params={"secret": SECRET},
+        headers={"X-Postback-Secret": "wrong"},
+    ) == 200
+
+
+@pytest.mark.parametrize(
+    "params, headers",
+    [
+        ({}, {}),
+        ({"secret": ""}, {}),
+        ({"secret": "wrong"}, {}),
+        ({"secret": SECRET + "x"}, {}),
+        ({}, {"X-Postback-Secret": "wrong"}),
+    ],
+)
+def test_wrong_secret_is_forbidden(secret_client, params, headers):
+    # ответ 403 — общий объект исключения: повторные отказы не должны меняться
+    for _ in range(2):
+        r = secret_client.get(URL, params=params, headers=headers)
+        assert r.status_code == 403
+        assert r.json() == {"detail": "Forbidden"}
+
+
+def test_secret_checked_on_post(secret_client):
+    assert secret_client.post(URL, data={"trader_id": "t1"}).status_code == 403
+    r = secret_client.post(URL, params={"secret": SECRET}, data={"trader_id": "t1"})
+    assert r.status_code == 200